@@ -18,8 +18,8 @@ def get_available_batches(item_code):
         from_warehouse = request.args.get('from_warehouse', '')
         
         # Import SAPIntegration dynamically to avoid circular imports
-        from sap_integration import SAPIntegration
-        sap = SAPIntegration()
+        from sap_integration import get_sap
+        sap = get_sap()
         
         # Get batch details from SAP B1
         batches = sap.get_item_batches(item_code)
@@ -61,8 +61,8 @@ def get_batch_stock(item_code, batch_number):
         warehouse = request.args.get('warehouse', '')
         
         # Import SAPIntegration dynamically to avoid circular imports
-        from sap_integration import SAPIntegration
-        sap = SAPIntegration()
+        from sap_integration import get_sap
+        sap = get_sap()
         
         # Get specific batch stock from SAP B1
         stock_info = sap.get_batch_stock(item_code, batch_number, warehouse)
@@ -100,8 +100,8 @@ def validate_batch_quantity():
         requested_qty = float(request.args.get('quantity', 0))
         
         # Import SAPIntegration dynamically to avoid circular imports
-        from sap_integration import SAPIntegration
-        sap = SAPIntegration()
+        from sap_integration import get_sap
+        sap = get_sap()
         
         # Get batch stock
         stock_info = sap.get_batch_stock(item_code, batch_number, warehouse)
@@ -5,7 +5,8 @@ Provides warehouses, bin locations, and batch data for dynamic dropdowns
 from flask import jsonify, request
 from app import app
 from flask_login import login_required
-from sap_integration import SAPIntegration
+from sap_integration import get_sap, fetch_warehouses
+from http_cache import conditional_json
 import logging
 
 @app.route('/api/warehouses', methods=['GET'])
@@ -13,24 +14,13 @@ import logging
 def cascading_get_warehouses():
     """Get all available warehouses"""
     try:
-        sap = SAPIntegration()
-        
-        # Try to get warehouses from SAP B1
-        if sap.ensure_logged_in():
-            try:
-                url = f"{sap.base_url}/b1s/v1/Warehouses"
-                response = sap.session.get(url, timeout=10)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    warehouses = data.get('value', [])
-                    logging.info(f"Retrieved {len(warehouses)} warehouses from SAP B1")
-                    return jsonify({
-                        'success': True,
-                        'warehouses': warehouses
-                    })
-            except Exception as e:
-                logging.error(f"Error getting warehouses from SAP: {str(e)}")
+        # Shared with /api/get-warehouses, cached in process
+        warehouses = fetch_warehouses()
+        if warehouses is not None:
+            return conditional_json({
+                'success': True,
+                'warehouses': warehouses
+            }, max_age=app.config['SAP_WAREHOUSE_CACHE_TTL'])
         
         # Return mock data for offline mode or on error
         return jsonify({
@@ -63,7 +53,7 @@ def cascading_get_bin_locations():
         if not warehouse_code:
             return jsonify({'success': False, 'error': 'Warehouse code required'}), 400
         
-        sap = SAPIntegration()
+        sap = get_sap()
         
         # Try to get bin locations from SAP B1
         if sap.ensure_logged_in():
@@ -116,7 +106,7 @@ def cascading_get_batches():
         if not item_code:
             return jsonify({'success': False, 'error': 'Item code is required'}), 400
         
-        sap = SAPIntegration()
+        sap = get_sap()
         
         # Try to get batches from SAP B1
         if sap.ensure_logged_in():
@@ -3,7 +3,7 @@ API Routes for GRPO Dropdown Functionality
 Warehouse, Bin Location, and Batch selection endpoints
 """
 from flask import jsonify, request
-from sap_integration import SAPIntegration
+from sap_integration import get_sap
 import logging
 
 def register_api_routes(app):
@@ -13,7 +13,7 @@ def register_api_routes(app):
     def get_warehouses():
         """Get all warehouses for dropdown selection"""
         try:
-            sap = SAPIntegration()
+            sap = get_sap()
             result = sap.get_warehouses_list()
             
             if result.get('success'):
@@ -41,7 +41,7 @@ def register_api_routes(app):
             if not warehouse_code:
                 return jsonify({'success': False, 'error': 'Warehouse code required'}), 400
             
-            sap = SAPIntegration()
+            sap = get_sap()
             result = sap.get_bin_locations_list(warehouse_code)
             
             if result.get('success'):
@@ -72,7 +72,7 @@ def register_api_routes(app):
             if not item_code:
                 return jsonify({'success': False, 'error': 'Item code required'}), 400
             
-            sap = SAPIntegration()
+            sap = get_sap()
             # Use the specific SAP B1 API for batch details
             result = sap.get_batch_number_details(item_code)
             
@@ -98,7 +98,7 @@ def register_api_routes(app):
             if not item_code:
                 return jsonify({'success': False, 'error': 'Item code required'}), 400
             
-            sap = SAPIntegration()
+            sap = get_sap()
             
             # Try to get item name from SAP B1
             if sap.ensure_logged_in():
@@ -52,10 +52,11 @@ if database_url_env and ("postgres" in database_url_env or "postgresql" in datab
         
         app.config["SQLALCHEMY_DATABASE_URI"] = database_url_env
         app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-            "pool_recycle": 300,
-            "pool_pre_ping": True,
-            "pool_size": 5,
-            "max_overflow": 10
+            "pool_size": 20,
+            "max_overflow": 10,
+            "pool_timeout": 30,
+            "pool_recycle": 1800,
+            "pool_pre_ping": True
         }
         db_type = "postgresql"
         
@@ -101,10 +102,11 @@ if not database_url:
             
             app.config["SQLALCHEMY_DATABASE_URI"] = database_url
             app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-                "pool_recycle": 300,
-                "pool_pre_ping": True,
-                "pool_size": 10,
-                "max_overflow": 20
+                "pool_size": 20,
+                "max_overflow": 10,
+                "pool_timeout": 30,
+                "pool_recycle": 1800,
+                "pool_pre_ping": True
             }
             db_type = "mysql"
             logging.info("✅ MySQL database connection successful")
@@ -134,6 +136,17 @@ if 'db_type' not in locals():
 # Store database type for use in other modules
 app.config["DB_TYPE"] = db_type
 
+# Keep compiled SQL for more distinct statements than SQLAlchemy's default 500
+app.config["SQLALCHEMY_ENGINE_OPTIONS"]["query_cache_size"] = 1200
+
+# Let browsers and the scanner apps reuse static assets (CSS/JS/icons) for an hour
+# instead of re-validating each one on every page load
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = int(os.environ.get('STATIC_MAX_AGE', 3600))
+
+# Templates are only re-checked on disk when explicitly enabled (or in debug mode)
+if os.environ.get('TEMPLATES_AUTO_RELOAD'):
+    app.config['TEMPLATES_AUTO_RELOAD'] = os.environ['TEMPLATES_AUTO_RELOAD'].lower() == 'true'
+
 # Initialize extensions with app
 db.init_app(app)
 login_manager.init_app(app)
@@ -148,15 +161,77 @@ app.config['SAP_B1_PASSWORD'] = os.environ.get('SAP_B1_PASSWORD', '1422')
 app.config['SAP_B1_COMPANY_DB'] = os.environ.get('SAP_B1_COMPANY_DB',
                                                  'SBODemoUS')
 
+# Seconds the SAP warehouse list is cached in process
+app.config['SAP_WAREHOUSE_CACHE_TTL'] = int(os.environ.get('SAP_WAREHOUSE_CACHE_TTL', 300))
+
+# Password hashing - pbkdf2 with a tuned iteration count (Werkzeug's default is 600000)
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD',
+                                                    'pbkdf2:sha256:260000')
+
 # Import models after app is configured to avoid circular imports
 import models
 import models_extensions
 
+
+def insert_ignore(model, rows):
+    """Insert rows in a single statement, skipping rows whose keys already exist"""
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(model).values(rows).on_conflict_do_nothing()
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(model).values(rows).on_conflict_do_nothing()
+    else:
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(model).values(rows).prefix_with('IGNORE')
+    return db.session.execute(stmt)
+
+
 with app.app_context():
     # Create all database tables first
     db.create_all()
     logging.info("Database tables created")
     
+    # create_all() skips tables that already exist, so add any missing indexes
+    try:
+        from models import User, SerialNumberTransfer
+        for model in (User, SerialNumberTransfer):
+            for index in model.__table__.indexes:
+                index.create(db.engine, checkfirst=True)
+    except Exception as e:
+        logging.warning(f"⚠️ Could not create indexes: {e}")
+    
+    # create_all() doesn't add new columns to existing tables either
+    try:
+        from sqlalchemy import inspect, text
+        from models import SerialNumberTransfer
+        table = SerialNumberTransfer.__table__
+        existing_columns = {c['name'] for c in inspect(db.engine).get_columns(table.name)}
+        with db.engine.begin() as conn:
+            for column in table.columns:
+                if column.name not in existing_columns and column.nullable:
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} "
+                                      f"{column.type.compile(db.engine.dialect)}"))
+                    logging.info(f"✅ Added column {table.name}.{column.name}")
+    except Exception as e:
+        logging.warning(f"⚠️ Could not add missing columns: {e}")
+    
+    # PostgreSQL: trigram index so the user search can match anywhere in the text
+    app.config['USER_TRGM_SEARCH'] = False
+    if db_type == "postgresql":
+        try:
+            from sqlalchemy import text
+            from models import USER_SEARCH_EXPR
+            with db.engine.begin() as conn:
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                conn.execute(text(
+                    f"CREATE INDEX IF NOT EXISTS ix_users_search_trgm ON users "
+                    f"USING gin (({USER_SEARCH_EXPR}) gin_trgm_ops)"))
+            app.config['USER_TRGM_SEARCH'] = True
+        except Exception as e:
+            logging.warning(f"⚠️ pg_trgm not available, user search uses prefix matching: {e}")
+    
     # Fix duplicate serial number constraint issue - drop unique constraint to allow duplicates
     if db_type == "mysql":
         try:
@@ -186,22 +261,21 @@ with app.app_context():
         from werkzeug.security import generate_password_hash
         from models import User
         
-        # Create default branch
-        default_branch = Branch.query.filter_by(id='BR001').first()
-        if not default_branch:
-            default_branch = Branch()
-            default_branch.id = 'BR001'
-            default_branch.name = 'Main Branch'
-            default_branch.branch_code = 'BR001'  # Required field
-            default_branch.branch_name = 'Main Branch'  # Required field
-            default_branch.description = 'Main Office Branch'
-            default_branch.address = 'Main Office'
-            default_branch.phone = '123-456-7890'
-            default_branch.email = 'main@company.com'
-            default_branch.manager_name = 'Branch Manager'
-            default_branch.active = True
-            default_branch.is_default = True
-            db.session.add(default_branch)
+        # Create default branch, skipping it if another worker already did
+        result = insert_ignore(Branch, [{
+            'id': 'BR001',
+            'name': 'Main Branch',
+            'branch_code': 'BR001',  # Required field
+            'branch_name': 'Main Branch',  # Required field
+            'description': 'Main Office Branch',
+            'address': 'Main Office',
+            'phone': '123-456-7890',
+            'email': 'main@company.com',
+            'manager_name': 'Branch Manager',
+            'active': True,
+            'is_default': True
+        }])
+        if result.rowcount:
             logging.info("Default branch created")
         
         # Create default admin user
@@ -210,7 +284,8 @@ with app.app_context():
             admin = User()
             admin.username = 'admin'
             admin.email = 'admin@company.com'
-            admin.password_hash = generate_password_hash('admin123')
+            admin.password_hash = generate_password_hash(
+                'admin123', method=app.config['PASSWORD_HASH_METHOD'])
             admin.first_name = 'System'
             admin.last_name = 'Administrator'
             admin.role = 'admin'
@@ -221,7 +296,7 @@ with app.app_context():
             admin.must_change_password = False
             db.session.add(admin)
             logging.info("Default admin user created")
-            
+        
         db.session.commit()
         logging.info("✅ Default data initialization completed")
         
@@ -244,3 +319,11 @@ except Exception as e:
 
 # Import routes to register them
 import routes
+
+# Compile the most used templates now instead of on each worker's first request
+for template_name in ('base.html', 'login.html', 'dashboard.html',
+                      'serial_transfer_index.html', 'qc_dashboard.html', 'user_management.html'):
+    try:
+        app.jinja_env.get_template(template_name)
+    except Exception as e:
+        logging.warning(f"⚠️ Could not precompile template {template_name}: {e}")
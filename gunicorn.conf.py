@@ -0,0 +1,18 @@
+"""
+Gunicorn configuration (loaded automatically from the working directory)
+Most request time is spent waiting on SAP B1 HTTP calls, so a single worker runs
+a pool of threads instead of handling one request at a time
+"""
+import os
+
+# One process by default: the in-process caches (dashboard counts, login branches,
+# SAP master data) are invalidated immediately only within the same process.
+# With GUNICORN_WORKERS > 1 another worker can serve a stale dashboard count for
+# up to 60s and a stale branch list for up to 10 minutes.
+workers = int(os.environ.get('GUNICORN_WORKERS', 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+
+# SAP B1 calls use up to 30s timeouts; leave headroom before a worker is killed
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+keepalive = 5
@@ -0,0 +1,14 @@
+"""
+HTTP caching helpers
+Lets clients that poll lookup APIs revalidate with If-None-Match instead of re-downloading
+"""
+from flask import jsonify, request
+
+
+def conditional_json(payload, max_age):
+    """JSON response with an ETag and max-age; 304 when the client's copy is current"""
+    response = jsonify(payload)
+    response.add_etag()
+    response.cache_control.private = True
+    response.cache_control.max_age = max_age
+    return response.make_conditional(request)
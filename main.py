@@ -6,5 +6,8 @@ import routes
 # Import cascading dropdown APIs
 import api_cascading_dropdowns
 
+# Resume SAP B1 postings that were queued when the server last stopped
+routes.requeue_sap_postings()
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
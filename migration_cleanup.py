@@ -4,160 +4,143 @@ Database cleanup migration to remove batch transfer functionality
 Keeps only User and SerialTransfer related tables
 """
 import logging
-from sqlalchemy import text, inspect
+from sqlalchemy import inspect, update, case, literal
 from app import app, db
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-def cleanup_database():
+# New permission structure (only available modules)
+_AVAILABLE_PERMISSIONS = {
+    'dashboard': True,
+    'serial_transfer': False,
+    'user_management': False
+}
+
+# Permissions per role, computed once at import
+_ROLE_PERMISSIONS = {
+    'admin': {key: True for key in _AVAILABLE_PERMISSIONS},
+    'manager': dict(_AVAILABLE_PERMISSIONS, serial_transfer=True, user_management=True),
+    'user': dict(_AVAILABLE_PERMISSIONS, serial_transfer=True),
+    'qc': dict(_AVAILABLE_PERMISSIONS, serial_transfer=True)
+}
+
+def cleanup_database(connection):
     """Remove all batch transfer tables and keep only serial transfer tables"""
+    inspector = inspect(connection)
+    existing_tables = set(inspector.get_table_names())
     
-    with app.app_context():
-        try:
-            # Get database connection
-            connection = db.engine.connect()
-            inspector = inspect(db.engine)
-            existing_tables = inspector.get_table_names()
-            
-            logging.info("🧹 Starting database cleanup...")
-            logging.info(f"Found {len(existing_tables)} tables in database")
-            
-            # Tables to keep (only these will remain)
-            keep_tables = {
-                'users',
-                'serial_number_transfers', 
-                'serial_number_transfer_items',
-                'serial_number_transfer_serials',
-                'branches'  # Keep branches for user management
-            }
-            
-            # Tables to remove (batch transfer and other unwanted modules)
-            tables_to_remove = [
-                'inventory_transfers',
-                'inventory_transfer_items',
-                'grpo_documents',
-                'grpo_items', 
-                'pick_lists',
-                'pick_list_items',
-                'pick_list_lines',
-                'pick_list_bin_allocations',
-                'sales_orders',
-                'sales_order_lines',
-                'inventory_counts',
-                'inventory_count_items',
-                'barcode_labels',
-                'bin_locations',
-                'bin_items', 
-                'bin_scanning_logs',
-                'qr_code_labels',
-                'document_number_series'
-            ]
-            
-            # Start transaction
-            trans = connection.begin()
-            
-            try:
-                # Disable foreign key constraints temporarily (for SQLite)
-                try:
-                    connection.execute(text("PRAGMA foreign_keys = OFF"))
-                except:
-                    pass  # Not SQLite, probably PostgreSQL
-                
-                # Drop unwanted tables that exist
-                dropped_count = 0
-                for table_name in tables_to_remove:
-                    if table_name in existing_tables:
-                        try:
-                            connection.execute(text(f"DROP TABLE IF EXISTS {table_name} CASCADE"))
-                            logging.info(f"✅ Dropped table: {table_name}")
-                            dropped_count += 1
-                        except Exception as e:
-                            logging.warning(f"⚠️  Could not drop table {table_name}: {e}")
-                
-                # Re-enable foreign key constraints
+    logging.info("🧹 Starting database cleanup...")
+    logging.info(f"Found {len(existing_tables)} tables in database")
+    
+    # Tables to keep (only these will remain)
+    keep_tables = {
+        'users',
+        'serial_number_transfers', 
+        'serial_number_transfer_items',
+        'serial_number_transfer_serials',
+        'branches'  # Keep branches for user management
+    }
+    
+    # Tables to remove (batch transfer and other unwanted modules)
+    tables_to_remove = [
+        'inventory_transfers',
+        'inventory_transfer_items',
+        'grpo_documents',
+        'grpo_items', 
+        'pick_lists',
+        'pick_list_items',
+        'pick_list_lines',
+        'pick_list_bin_allocations',
+        'sales_orders',
+        'sales_order_lines',
+        'inventory_counts',
+        'inventory_count_items',
+        'barcode_labels',
+        'bin_locations',
+        'bin_items', 
+        'bin_scanning_logs',
+        'qr_code_labels',
+        'document_number_series'
+    ]
+    
+    dialect = connection.dialect.name
+    prep = connection.dialect.identifier_preparer
+    
+    # Disable foreign key constraints temporarily
+    if dialect == 'sqlite':
+        connection.exec_driver_sql("PRAGMA foreign_keys = OFF")
+    elif dialect == 'mysql':
+        connection.exec_driver_sql("SET FOREIGN_KEY_CHECKS = 0")
+    
+    dropped_tables = []
+    try:
+        # Drop unwanted tables that exist
+        targets = [t for t in tables_to_remove if t in existing_tables]
+        if dialect == 'sqlite':
+            # SQLite doesn't accept multi-table DROP, drop one by one
+            for table_name in targets:
                 try:
-                    connection.execute(text("PRAGMA foreign_keys = ON"))
-                except:
-                    pass  # Not SQLite
-                
-                # Commit transaction
-                trans.commit()
-                
-                logging.info(f"🎉 Database cleanup completed! Dropped {dropped_count} unwanted tables")
-                logging.info(f"📊 Kept {len(keep_tables)} essential tables: {', '.join(sorted(keep_tables))}")
-                
-                # Verify remaining tables
-                remaining_tables = inspect(db.engine).get_table_names()
-                logging.info(f"📋 Remaining tables: {', '.join(sorted(remaining_tables))}")
-                
-                return True
-                
-            except Exception as e:
-                # Rollback on error
-                trans.rollback()
-                logging.error(f"❌ Error during cleanup: {e}")
-                return False
-            finally:
-                connection.close()
-            
-        except Exception as e:
-            logging.error(f"❌ Database connection error: {e}")
-            return False
+                    connection.exec_driver_sql(f"DROP TABLE IF EXISTS {prep.quote(table_name)}")
+                    logging.info(f"✅ Dropped table: {table_name}")
+                    dropped_tables.append(table_name)
+                except Exception as e:
+                    logging.warning(f"⚠️  Could not drop table {table_name}: {e}")
+        elif targets:
+            # MySQL/PostgreSQL: drop all tables in a single statement
+            connection.exec_driver_sql(
+                "DROP TABLE IF EXISTS " + ", ".join(prep.quote(t) for t in targets) + " CASCADE"
+            )
+            dropped_tables = targets
+            logging.info(f"✅ Dropped tables: {', '.join(targets)}")
+    finally:
+        # Re-enable foreign key constraints, also when a DROP fails
+        # (on MySQL the setting stays on the pooled connection otherwise)
+        if dialect == 'sqlite':
+            connection.exec_driver_sql("PRAGMA foreign_keys = ON")
+        elif dialect == 'mysql':
+            connection.exec_driver_sql("SET FOREIGN_KEY_CHECKS = 1")
+    
+    logging.info(f"🎉 Database cleanup completed! Dropped {len(dropped_tables)} unwanted tables")
+    logging.info(f"📊 Kept {len(keep_tables)} essential tables: {', '.join(sorted(keep_tables))}")
+    
+    # Remaining tables, derived from the initial listing
+    remaining_tables = existing_tables - set(dropped_tables)
+    logging.info(f"📋 Remaining tables: {', '.join(sorted(remaining_tables))}")
 
-def update_user_permissions():
+def update_user_permissions(connection):
     """Update user permissions to only include available modules"""
+    from models import User
+    
+    # Update every user in a single statement based on role
+    # (payloads are bound with the column's JSON type, not as plain strings)
+    json_type = User.permissions.type
+    stmt = update(User).values(
+        permissions=case(
+            {role: literal(perms, json_type) for role, perms in _ROLE_PERMISSIONS.items()},
+            value=User.role,
+            else_=literal(dict(_AVAILABLE_PERMISSIONS), json_type)
+        )
+    )
+    result = connection.execute(stmt)
+    logging.info(f"✅ Updated permissions for {result.rowcount} users")
+
+def run_migration():
+    """Run the cleanup and permission update on one connection and transaction
+    
+    Only PostgreSQL rolls back both on failure. MySQL (implicit commit) and SQLite
+    (pysqlite autocommits DDL) keep tables already dropped, so a failed permission
+    update leaves them dropped; rerunning the migration is safe.
+    """
     with app.app_context():
         try:
-            from models import User
-            import json
-            
-            # New permission structure (only available modules)
-            available_permissions = {
-                'dashboard': True,
-                'serial_transfer': False,
-                'user_management': False
-            }
-            
-            users = User.query.all()
-            updated_count = 0
-            
-            for user in users:
-                try:
-                    # Create new permissions based on role and available modules
-                    new_perms = available_permissions.copy()
-                    
-                    if user.role == 'admin':
-                        # Admin gets all permissions
-                        for key in new_perms:
-                            new_perms[key] = True
-                    elif user.role == 'manager':
-                        new_perms.update({
-                            'serial_transfer': True,
-                            'user_management': True
-                        })
-                    elif user.role == 'user':
-                        new_perms.update({
-                            'serial_transfer': True
-                        })
-                    elif user.role == 'qc':
-                        new_perms.update({
-                            'serial_transfer': True
-                        })
-                    
-                    # Update user permissions
-                    user.set_permissions(new_perms)
-                    updated_count += 1
-                    
-                except Exception as e:
-                    logging.warning(f"Could not update permissions for user {user.username}: {e}")
-            
-            db.session.commit()
-            logging.info(f"✅ Updated permissions for {updated_count} users")
-            
+            with db.engine.begin() as connection:
+                cleanup_database(connection)
+                update_user_permissions(connection)
+            return True
         except Exception as e:
-            logging.error(f"Error updating user permissions: {e}")
-            db.session.rollback()
+            logging.error(f"❌ Error during cleanup: {e}")
+            return False
 
 if __name__ == '__main__':
     print("🚀 Starting WMS Database Cleanup Migration")
@@ -168,9 +151,8 @@ if __name__ == '__main__':
     print("=" * 50)
     
     # Auto-confirm for non-interactive environment
-    success = cleanup_database()
+    success = run_migration()
     if success:
-        update_user_permissions()
         print("\n🎉 Migration completed successfully!")
         print("The application now contains only the requested modules.")
     else:
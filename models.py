@@ -1,9 +1,59 @@
+import json
+import logging
 from datetime import datetime
+from types import MappingProxyType
+from flask import g, has_request_context
 from flask_login import UserMixin
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import relationship
 from app import db
 
+# Default screen permissions, built once per role
+_BASE_PERMISSIONS = MappingProxyType({
+    'dashboard': True,
+    'serial_transfer': False,
+    'user_management': False,
+    'qc_dashboard': False
+})
+
+_DEFAULT_BY_ROLE = {
+    # Admin has access to everything
+    'admin': MappingProxyType({key: True for key in _BASE_PERMISSIONS}),
+    'manager': MappingProxyType(dict(_BASE_PERMISSIONS,
+                                     serial_transfer=True,
+                                     user_management=True,
+                                     qc_dashboard=True)),
+    'user': MappingProxyType(dict(_BASE_PERMISSIONS, serial_transfer=True)),
+    'qc': MappingProxyType(dict(_BASE_PERMISSIONS,
+                                serial_transfer=True,  # QC can view transfers
+                                qc_dashboard=True))
+}
+
+
+class LenientJSON(db.TypeDecorator):
+    """JSON column that reads malformed legacy values (e.g. '' in an old TEXT column) as None"""
+    impl = db.JSON
+    cache_ok = True
+
+    def result_processor(self, dialect, coltype):
+        process = super().result_processor(dialect, coltype)
+        if process is None:
+            return None
+
+        def lenient_process(value):
+            try:
+                return process(value)
+            except ValueError:
+                logging.warning(f"⚠️ Ignoring malformed JSON value: {value!r:.80}")
+                return None
+        return lenient_process
+
+
+# Text searched by the user management page; PostgreSQL indexes this exact
+# expression with pg_trgm (username, email and role are NOT NULL)
+USER_SEARCH_EXPR = ("(username || ' ' || email || ' ' || coalesce(first_name, '') || ' ' "
+                    "|| coalesce(last_name, '') || ' ' || role)")
+
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
@@ -24,64 +74,51 @@ class User(UserMixin, db.Model):
     must_change_password = db.Column(
         db.Boolean, default=False)  # Force password change on next login
     last_login = db.Column(db.DateTime, nullable=True)
-    permissions = db.Column(db.Text,
-                         nullable=True)  # JSON string of screen permissions
+    permissions = db.Column(LenientJSON,
+                         nullable=True)  # Screen permissions dictionary
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime,
                         default=datetime.utcnow,
                         onupdate=datetime.utcnow)
 
+    # Serve the user management listing ordered by creation date
+    __table_args__ = (
+        db.Index('ix_users_created_id', 'created_at', 'id'),
+    )
+
     def get_permissions(self):
         """Get user permissions as a dictionary"""
-        import json
-        if self.permissions:
+        permissions = self.permissions
+        if isinstance(permissions, str):
+            # Legacy TEXT column that the driver doesn't decode as JSON
             try:
-                return json.loads(self.permissions)
+                permissions = json.loads(permissions)
             except:
                 return {}
-        return self.get_default_permissions()
+        return permissions or self.get_default_permissions()
 
     def set_permissions(self, perms_dict):
         """Set user permissions from a dictionary"""
-        import json
-        self.permissions = json.dumps(perms_dict)
+        self.permissions = dict(perms_dict)
+        if has_request_context():
+            g.pop('_permissions_cache', None)
 
     def get_default_permissions(self):
         """Get default permissions based on role"""
-        permissions = {
-            'dashboard': True,
-            'serial_transfer': False,
-            'user_management': False,
-            'qc_dashboard': False
-        }
-
-        if self.role == 'admin':
-            # Admin has access to everything
-            for key in permissions:
-                permissions[key] = True
-        elif self.role == 'manager':
-            permissions.update({
-                'serial_transfer': True,
-                'user_management': True,
-                'qc_dashboard': True
-            })
-        elif self.role == 'user':
-            permissions.update({
-                'serial_transfer': True
-            })
-        elif self.role == 'qc':
-            permissions.update({
-                'serial_transfer': True,  # QC can view transfers
-                'qc_dashboard': True
-            })
-
-        return permissions
+        return dict(_DEFAULT_BY_ROLE.get(self.role, _BASE_PERMISSIONS))
 
     def has_permission(self, screen):
         """Check if user has permission for a specific screen"""
         if self.role == 'admin':
             return True
-        return self.get_permissions().get(screen, False)
+        if not has_request_context():
+            return self.get_permissions().get(screen, False)
+        # Templates check several screens per render; resolve permissions once per request
+        cache = g.setdefault('_permissions_cache', {})
+        key = (self.id, self.role)
+        if key not in cache:
+            cache[key] = self.get_permissions()
+        return cache[key].get(screen, False)
 
 
 # ================================
@@ -100,6 +137,8 @@ class SerialNumberTransfer(db.Model):
     qc_approver_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     qc_approved_at = db.Column(db.DateTime)
     qc_notes = db.Column(db.Text)
+    sap_post_error = db.Column(db.Text)  # Last SAP B1 posting error, shown to QC
+    sap_post_started_at = db.Column(db.DateTime)  # Set when a worker claims the SAP B1 posting
     from_warehouse = db.Column(db.String(10), nullable=False)
     to_warehouse = db.Column(db.String(10), nullable=False)
     priority = db.Column(db.String(10), default='normal')  # low, normal, high, urgent
@@ -110,7 +149,17 @@ class SerialNumberTransfer(db.Model):
     # Relationships
     user = db.relationship('User', foreign_keys=[user_id], backref='serial_transfers')
     qc_approver = db.relationship('User', foreign_keys=[qc_approver_id])
-    items = db.relationship('SerialNumberTransferItem', backref='serial_transfer', lazy=True, cascade='all, delete-orphan')
+    # Collections load with one extra SELECT ... IN per level instead of one query per row
+    items = db.relationship('SerialNumberTransferItem', back_populates='serial_transfer', lazy='selectin', cascade='all, delete-orphan')
+    
+    # Serve per-user and per-status listings ordered by creation date,
+    # and the QC reviewer's recent decisions ordered by approval date
+    # (B-tree indexes are read backwards for the DESC orderings)
+    __table_args__ = (
+        db.Index('ix_snt_user_created', 'user_id', 'created_at'),
+        db.Index('ix_snt_status_created', 'status', 'created_at'),
+        db.Index('ix_snt_approver_approved', 'qc_approver_id', 'qc_approved_at'),
+    )
 
 class SerialNumberTransferItem(db.Model):
     """Serial Number Transfer Line Items"""
@@ -129,7 +178,8 @@ class SerialNumberTransferItem(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
-    serial_numbers = db.relationship('SerialNumberTransferSerial', backref='transfer_item', lazy=True, cascade='all, delete-orphan')
+    serial_transfer = db.relationship('SerialNumberTransfer', back_populates='items')
+    serial_numbers = db.relationship('SerialNumberTransferSerial', back_populates='transfer_item', lazy='selectin', cascade='all, delete-orphan')
 
 class SerialNumberTransferSerial(db.Model):
     """Individual Serial Numbers for Transfer Items"""
@@ -146,7 +196,10 @@ class SerialNumberTransferSerial(db.Model):
     expiry_date = db.Column(db.Date)
     admission_date = db.Column(db.Date)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
+
+    # Relationships
+    transfer_item = db.relationship('SerialNumberTransferItem', back_populates='serial_numbers')
+
     # Note: Unique constraint removed to allow duplicate serial numbers for user review
     # Users can now add duplicates and manually delete unwanted entries from the UI
     # __table_args__ = (db.UniqueConstraint('transfer_item_id', 'serial_number', name='unique_serial_per_item'),)
\ No newline at end of file
@@ -1,3 +1,4 @@
+import json
 from app import db
 from datetime import datetime
 
@@ -31,7 +32,6 @@ class Branch(db.Model):
     def get_warehouses(self):
         """Get list of warehouse codes for this branch"""
         if self.warehouse_codes:
-            import json
             try:
                 return json.loads(self.warehouse_codes)
             except:
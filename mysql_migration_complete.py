@@ -6,8 +6,11 @@ Creates all necessary tables for Serial Transfer functionality with QC approval
 
 import os
 import sys
+import json
 import logging
 import pymysql
+from pymysql.constants import CLIENT
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from werkzeug.security import generate_password_hash
 
@@ -29,7 +32,8 @@ class MySQLMigration:
             'password': os.getenv('MYSQL_PASSWORD') or input('MySQL Password: '),
             'database': os.getenv('MYSQL_DATABASE') or input('Database Name (wms): ') or 'wms',
             'charset': 'utf8mb4',
-            'autocommit': False
+            'autocommit': False,
+            'client_flag': CLIENT.MULTI_STATEMENTS
         }
         return config
     
@@ -45,7 +49,7 @@ class MySQLMigration:
             return False
     
     def create_tables(self):
-        """Create all WMS tables with latest schema"""
+        """Create all WMS tables with latest schema (secondary indexes are added by create_indexes)"""
         
         tables = {
             # 1. Branches/Locations
@@ -68,10 +72,8 @@ class MySQLMigration:
                     active BOOLEAN DEFAULT TRUE,
                     is_default BOOLEAN DEFAULT FALSE,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    INDEX idx_branch_code (branch_code),
-                    INDEX idx_active (active)
-                )
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci
             ''',
             
             # 2. Users with comprehensive role management
@@ -90,15 +92,10 @@ class MySQLMigration:
                     active BOOLEAN DEFAULT TRUE,
                     must_change_password BOOLEAN DEFAULT FALSE,
                     last_login TIMESTAMP NULL,
-                    permissions TEXT,
+                    permissions JSON,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    INDEX idx_username (username),
-                    INDEX idx_email (email),
-                    INDEX idx_role (role),
-                    INDEX idx_active (active),
-                    INDEX idx_branch_id (branch_id)
-                )
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci
             ''',
             
             # 3. Serial Number Transfer Documents
@@ -112,22 +109,15 @@ class MySQLMigration:
                     qc_approver_id INT NULL,
                     qc_approved_at TIMESTAMP NULL,
                     qc_notes TEXT NULL,
+                    sap_post_error TEXT NULL,
+                    sap_post_started_at TIMESTAMP NULL,
                     from_warehouse VARCHAR(10) NOT NULL,
                     to_warehouse VARCHAR(10) NOT NULL,
                     priority VARCHAR(10) DEFAULT 'normal',
                     notes TEXT NULL,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    INDEX idx_transfer_number (transfer_number),
-                    INDEX idx_status (status),
-                    INDEX idx_user_id (user_id),
-                    INDEX idx_qc_approver_id (qc_approver_id),
-                    INDEX idx_from_warehouse (from_warehouse),
-                    INDEX idx_to_warehouse (to_warehouse),
-                    INDEX idx_created_at (created_at),
-                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE RESTRICT,
-                    FOREIGN KEY (qc_approver_id) REFERENCES users(id) ON DELETE SET NULL
-                )
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci
             ''',
             
             # 4. Serial Transfer Items
@@ -143,12 +133,8 @@ class MySQLMigration:
                     to_warehouse_code VARCHAR(10) NOT NULL,
                     qc_status VARCHAR(20) DEFAULT 'pending',
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    INDEX idx_serial_transfer_id (serial_transfer_id),
-                    INDEX idx_item_code (item_code),
-                    INDEX idx_qc_status (qc_status),
-                    FOREIGN KEY (serial_transfer_id) REFERENCES serial_number_transfers(id) ON DELETE CASCADE
-                )
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci
             ''',
             
             # 5. Serial Numbers for Transfer Items
@@ -164,24 +150,125 @@ class MySQLMigration:
                     manufacturing_date DATE NULL,
                     expiry_date DATE NULL,
                     admission_date DATE NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    INDEX idx_transfer_item_id (transfer_item_id),
-                    INDEX idx_serial_number (serial_number),
-                    INDEX idx_is_validated (is_validated),
-                    FOREIGN KEY (transfer_item_id) REFERENCES serial_number_transfer_items(id) ON DELETE CASCADE
-                )
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci
             '''
         }
         
-        # Create tables
-        for table_name, table_sql in tables.items():
-            try:
-                logger.info(f"Creating table: {table_name}")
-                self.cursor.execute(table_sql)
-                logger.info(f"✅ Table {table_name} created successfully")
-            except Exception as e:
-                logger.error(f"❌ Error creating table {table_name}: {e}")
-                return False
+        # Create all tables in a single round-trip
+        try:
+            logger.info(f"Creating tables: {', '.join(tables)}")
+            self.cursor.execute(";\n".join(tables.values()))
+            while self.cursor.nextset():
+                pass
+            logger.info(f"✅ {len(tables)} tables created successfully")
+        except Exception as e:
+            logger.error(f"❌ Error creating tables: {e}")
+            self.connection.rollback()
+            return False
+        
+        return True
+    
+    def create_indexes(self):
+        """Add secondary indexes and foreign keys after the default data is loaded"""
+        
+        indexes = {
+            'branches': [
+                ('idx_branch_code', '(branch_code)'),
+                ('idx_active', '(active)')
+            ],
+            'users': [
+                ('idx_username', '(username)'),
+                ('idx_email', '(email)'),
+                ('idx_role', '(role)'),
+                ('idx_active', '(active)'),
+                ('idx_branch_id', '(branch_id)'),
+                ('ix_users_created_id', '(created_at, id)')  # same name as the User model index
+            ],
+            'serial_number_transfers': [
+                ('idx_transfer_number', '(transfer_number)'),
+                ('idx_user_status', '(user_id, status)'),
+                ('idx_qc_status_created', '(qc_approver_id, status, created_at DESC)'),
+                # Same names as the SerialNumberTransfer model indexes, so the app's
+                # startup index check finds them instead of adding duplicates
+                ('ix_snt_status_created', '(status, created_at)'),
+                ('ix_snt_user_created', '(user_id, created_at)'),
+                ('ix_snt_approver_approved', '(qc_approver_id, qc_approved_at)'),
+                ('idx_from_warehouse', '(from_warehouse)'),
+                ('idx_to_warehouse', '(to_warehouse)'),
+                ('idx_created_at', '(created_at)')
+            ],
+            'serial_number_transfer_items': [
+                ('idx_serial_transfer_id', '(serial_transfer_id)'),
+                ('idx_item_code', '(item_code)'),
+                ('idx_qc_status', '(qc_status)')
+            ],
+            'serial_number_transfer_serials': [
+                ('idx_item_validated', '(transfer_item_id, is_validated)'),
+                ('idx_serial_number', '(serial_number)'),
+                ('idx_is_validated', '(is_validated)')
+            ]
+        }
+        
+        # Indexes covered by a composite above, dropped from databases built earlier
+        obsolete_indexes = {
+            'serial_number_transfers': ['idx_status']  # prefix of ix_snt_status_created
+        }
+        
+        foreign_keys = {
+            'serial_number_transfers': [
+                ('user_id', 'REFERENCES users(id) ON DELETE RESTRICT'),
+                ('qc_approver_id', 'REFERENCES users(id) ON DELETE SET NULL')
+            ],
+            'serial_number_transfer_items': [
+                ('serial_transfer_id', 'REFERENCES serial_number_transfers(id) ON DELETE CASCADE')
+            ],
+            'serial_number_transfer_serials': [
+                ('transfer_item_id', 'REFERENCES serial_number_transfer_items(id) ON DELETE CASCADE')
+            ]
+        }
+        
+        try:
+            # Skip indexes and foreign keys already present from a previous run
+            self.cursor.execute("""
+                SELECT TABLE_NAME, INDEX_NAME FROM information_schema.STATISTICS
+                WHERE TABLE_SCHEMA = DATABASE()
+            """)
+            existing_indexes = set(self.cursor.fetchall())
+            self.cursor.execute("""
+                SELECT TABLE_NAME, COLUMN_NAME FROM information_schema.KEY_COLUMN_USAGE
+                WHERE TABLE_SCHEMA = DATABASE() AND REFERENCED_TABLE_NAME IS NOT NULL
+            """)
+            existing_foreign_keys = set(self.cursor.fetchall())
+            
+            # One ALTER TABLE per table, all sent in a single round-trip
+            statements = []
+            for table_name in indexes:
+                clauses = [
+                    f"DROP INDEX {index_name}"
+                    for index_name in obsolete_indexes.get(table_name, [])
+                    if (table_name, index_name) in existing_indexes
+                ] + [
+                    f"ADD INDEX {index_name} {columns}"
+                    for index_name, columns in indexes.get(table_name, [])
+                    if (table_name, index_name) not in existing_indexes
+                ] + [
+                    f"ADD FOREIGN KEY ({column}) {reference}"
+                    for column, reference in foreign_keys.get(table_name, [])
+                    if (table_name, column) not in existing_foreign_keys
+                ]
+                if clauses:
+                    statements.append(f"ALTER TABLE {table_name} " + ", ".join(clauses))
+            
+            if statements:
+                logger.info(f"Adding indexes and foreign keys on {len(statements)} tables")
+                self.cursor.execute(";\n".join(statements))
+                while self.cursor.nextset():
+                    pass
+            logger.info("✅ Indexes and foreign keys created successfully")
+        except Exception as e:
+            logger.error(f"❌ Error creating indexes: {e}")
+            return False
         
         return True
     
@@ -198,56 +285,41 @@ class MySQLMigration:
         except Exception as e:
             logger.warning(f"Branch insertion warning: {e}")
         
-        # Default admin user
+        # Default users (admin, QC, manager) in a single multi-row INSERT
         try:
-            admin_password = generate_password_hash('admin123')
+            # Same hash method the app uses for users it creates (see app.py); hashlib
+            # computes PBKDF2 and scrypt without holding the GIL, so the three hashes run concurrently
+            method = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:260000')
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                admin_password, qc_password, manager_password = executor.map(
+                    lambda password: generate_password_hash(password, method=method),
+                    ['admin123', 'qc123', 'manager123'])
+            full_permissions = {'dashboard': True, 'serial_transfer': True, 'user_management': True, 'qc_dashboard': True}
+            qc_permissions = {'dashboard': True, 'serial_transfer': True, 'qc_dashboard': True}
             self.cursor.execute("""
                 INSERT IGNORE INTO users (
                     username, email, password_hash, first_name, last_name, 
                     role, branch_id, active, permissions
                 ) VALUES (
                     'admin', 'admin@company.com', %s, 'System', 'Administrator',
-                    'admin', '01', TRUE, 
-                    '{"dashboard": true, "serial_transfer": true, "user_management": true, "qc_dashboard": true}'
-                )
-            """, (admin_password,))
-            logger.info("✅ Default admin user created (username: admin, password: admin123)")
-        except Exception as e:
-            logger.warning(f"Admin user creation warning: {e}")
-        
-        # Default QC user
-        try:
-            qc_password = generate_password_hash('qc123')
-            self.cursor.execute("""
-                INSERT IGNORE INTO users (
-                    username, email, password_hash, first_name, last_name, 
-                    role, branch_id, active, permissions
-                ) VALUES (
+                    'admin', '01', TRUE, %s
+                ), (
                     'qc_user', 'qc@company.com', %s, 'Quality Control', 'Officer',
-                    'qc', '01', TRUE, 
-                    '{"dashboard": true, "serial_transfer": true, "qc_dashboard": true}'
-                )
-            """, (qc_password,))
-            logger.info("✅ Default QC user created (username: qc_user, password: qc123)")
-        except Exception as e:
-            logger.warning(f"QC user creation warning: {e}")
-        
-        # Default manager user
-        try:
-            manager_password = generate_password_hash('manager123')
-            self.cursor.execute("""
-                INSERT IGNORE INTO users (
-                    username, email, password_hash, first_name, last_name, 
-                    role, branch_id, active, permissions
-                ) VALUES (
+                    'qc', '01', TRUE, %s
+                ), (
                     'manager', 'manager@company.com', %s, 'Warehouse', 'Manager',
-                    'manager', '01', TRUE, 
-                    '{"dashboard": true, "serial_transfer": true, "user_management": true, "qc_dashboard": true}'
+                    'manager', '01', TRUE, %s
                 )
-            """, (manager_password,))
+            """, (
+                admin_password, json.dumps(full_permissions),
+                qc_password, json.dumps(qc_permissions),
+                manager_password, json.dumps(full_permissions)
+            ))
+            logger.info("✅ Default admin user created (username: admin, password: admin123)")
+            logger.info("✅ Default QC user created (username: qc_user, password: qc123)")
             logger.info("✅ Default manager user created (username: manager, password: manager123)")
         except Exception as e:
-            logger.warning(f"Manager user creation warning: {e}")
+            logger.warning(f"Default users creation warning: {e}")
         
         return True
     
@@ -291,6 +363,10 @@ class MySQLMigration:
             if not self.insert_default_data():
                 return False
             
+            # Build indexes and foreign keys after the bulk load
+            if not self.create_indexes():
+                return False
+            
             # Commit changes
             if not self.commit_changes():
                 return False
@@ -1,14 +1,37 @@
+from concurrent.futures import ThreadPoolExecutor
 from flask import render_template, request, redirect, url_for, flash, jsonify, session
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
 import json
 
 from app import app, db, login_manager
-from models import User, SerialNumberTransfer, SerialNumberTransferItem, SerialNumberTransferSerial
-from sap_integration import SAPIntegration
-from sqlalchemy import or_
+from models import User, SerialNumberTransfer, SerialNumberTransferItem, SerialNumberTransferSerial, USER_SEARCH_EXPR
+from models_extensions import Branch
+from sap_integration import get_sap, fetch_warehouses
+from http_cache import conditional_json
+from sqlalchemy import or_, bindparam, func, select, update, literal_column
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import defer, joinedload, lazyload, raiseload, selectinload
+from ttl_cache import SingleFlight, TTLCache
+
+# In-process caches for SAP master data lookups
+_item_cache = TTLCache(maxsize=10000, ttl=600)  # keyed by item code
+_sap_lookups = SingleFlight()  # one SAP call per cache miss, concurrent requests wait for it
+MAX_ITEM_CODES_PER_LOOKUP = 200  # bounds the SAP calls one bulk item name request can trigger
+_branches_cache = TTLCache(maxsize=1, ttl=600)  # active branches for the login form
+_transfer_count_cache = TTLCache(maxsize=1024, ttl=60)  # dashboard count keyed by user id
+_missing_user_cache = TTLCache(maxsize=1024, ttl=60)  # session user ids with no users row
+_DUMMY_PASSWORD_HASH = None
+
+# Background worker for SAP B1 postings; a claim older than this is treated as
+# abandoned (worker restarted mid-post) and may be posted again
+_sap_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='sap-post')
+SAP_POST_STALE_AFTER = timedelta(minutes=10)
+
+# Single background writer for bookkeeping updates kept off the request path
+_write_behind_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='write-behind')
 
 # API Routes for Basic Functionality
 
@@ -16,24 +39,12 @@ from sqlalchemy import or_
 def get_warehouses():
     """Get all warehouses for dropdown selection"""
     try:
-        sap = SAPIntegration()
-        
-        # Try to get warehouses from SAP B1
-        if sap.ensure_logged_in():
-            try:
-                url = f"{sap.base_url}/b1s/v1/Warehouses"
-                response = sap.session.get(url, timeout=10)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    warehouses = data.get('value', [])
-                    logging.info(f"Retrieved {len(warehouses)} warehouses from SAP B1")
-                    return jsonify({
-                        'success': True,
-                        'warehouses': warehouses
-                    })
-            except Exception as e:
-                logging.error(f"Error getting warehouses from SAP: {str(e)}")
+        warehouses = fetch_warehouses()
+        if warehouses is not None:
+            return conditional_json({
+                'success': True,
+                'warehouses': warehouses
+            }, max_age=app.config['SAP_WAREHOUSE_CACHE_TTL'])
         
         # Return mock data for offline mode or on error
         return jsonify({
@@ -58,20 +69,31 @@ def get_item_name():
         if not item_code:
             return jsonify({'success': False, 'error': 'Item code required'}), 400
         
-        sap = SAPIntegration()
+        # Serve from cache when the item was looked up recently
+        item = _item_cache.get(item_code)
+        if item is not None:
+            return conditional_json(dict(item, success=True), max_age=_item_cache.ttl)
         
-        # Try to get item details from SAP B1
-        try:
-            if sap.ensure_logged_in():
-                item_data = sap.get_item_details(item_code)
-                if item_data:
-                    return jsonify({
-                        'success': True,
-                        'item_name': item_data.get('ItemName', f'Item {item_code}'),
-                        'uom': item_data.get('SalesUnit', 'EA')
-                    })
-        except Exception as e:
-            logging.error(f"Error getting item from SAP: {str(e)}")
+        sap = get_sap()
+        
+        # Try to get item details from SAP B1, once for all concurrent requests
+        with _sap_lookups.lock(('item', item_code)):
+            item = _item_cache.get(item_code)
+            if item is not None:
+                return conditional_json(dict(item, success=True), max_age=_item_cache.ttl)
+            
+            try:
+                if sap.ensure_logged_in():
+                    item_data = sap.get_item_details(item_code)
+                    if item_data:
+                        item = {
+                            'item_name': item_data.get('ItemName', f'Item {item_code}'),
+                            'uom': item_data.get('SalesUnit', 'EA')
+                        }
+                        _item_cache.set(item_code, item)
+                        return conditional_json(dict(item, success=True), max_age=_item_cache.ttl)
+            except Exception as e:
+                logging.error(f"Error getting item from SAP: {str(e)}")
         
         # Return fallback data
         return jsonify({
@@ -85,9 +107,75 @@ def get_item_name():
         logging.error(f"Error in get_item_name API: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/get-item-names', methods=['GET', 'POST'])
+def get_item_names():
+    """Get item names from SAP for several item codes in one call
+    
+    GET takes ?codes=A,B,C, POST takes JSON {"item_codes": [...]}
+    """
+    try:
+        if request.method == 'GET':
+            raw_codes = request.args.get('codes', '').split(',')
+        else:
+            data = request.get_json(silent=True)
+            raw_codes = (data.get('item_codes') if isinstance(data, dict) else None) or []
+            if not isinstance(raw_codes, list):
+                return jsonify({'success': False, 'error': 'item_codes must be a list'}), 400
+        item_codes = list(dict.fromkeys(str(code).strip() for code in raw_codes if str(code).strip()))
+        
+        if not item_codes:
+            return jsonify({'success': False, 'error': 'Item codes required'}), 400
+        if len(item_codes) > MAX_ITEM_CODES_PER_LOOKUP:
+            return jsonify({'success': False,
+                            'error': f'At most {MAX_ITEM_CODES_PER_LOOKUP} item codes per request'}), 400
+        
+        # Serve recently looked up items from cache, fetch the rest in one SAP call
+        items = {}
+        missing = []
+        for item_code in item_codes:
+            item = _item_cache.get(item_code)
+            if item is not None:
+                items[item_code] = item
+            else:
+                missing.append(item_code)
+        
+        if missing:
+            sap = get_sap()
+            try:
+                if sap.ensure_logged_in():
+                    for item_code, item_data in sap.get_items_details(missing).items():
+                        item = {
+                            'item_name': item_data.get('ItemName') or f'Item {item_code}',
+                            'uom': item_data.get('SalesUnit') or 'EA'
+                        }
+                        _item_cache.set(item_code, item)
+                        items[item_code] = item
+            except Exception as e:
+                logging.error(f"Error getting items from SAP: {str(e)}")
+        
+        # Fallback data for anything SAP did not return
+        for item_code in item_codes:
+            if item_code not in items:
+                items[item_code] = {'item_name': f'Item {item_code}', 'uom': 'EA', 'fallback': True}
+        
+        return jsonify({'success': True, 'items': items})
+        
+    except Exception as e:
+        logging.error(f"Error in get_item_names API: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # Tampered or stale session cookies: skip the lookup for ids known to be missing
+    if _missing_user_cache.get(user_id):
+        return None
+    try:
+        user = db.session.get(User, int(user_id))
+    except ValueError:
+        return None
+    if user is None:
+        _missing_user_cache.set(user_id, True)
+    return user
 
 @app.route('/')
 def index():
@@ -104,21 +192,37 @@ def login():
         
         user = User.query.filter_by(username=username).first()
         
-        if user and check_password_hash(user.password_hash, password):
+        # Unknown usernames still pay for one hash check, so response time
+        # does not reveal which usernames exist
+        password_ok = check_password_hash(user.password_hash if user else _dummy_password_hash(), password)
+        
+        if user and password_ok:
             if user.active:
+                # Collect the column changes for a single UPDATE
+                updates = {}
+                
+                # Upgrade hashes made with another method (e.g. Werkzeug's default); compare
+                # with the prefix Werkzeug actually writes, as the configured method may be
+                # a short form such as 'scrypt' or 'pbkdf2:sha256'
+                if user.password_hash.split('$', 1)[0] != _dummy_password_hash().split('$', 1)[0]:
+                    updates['password_hash'] = generate_password_hash(
+                        password, method=app.config['PASSWORD_HASH_METHOD'])
+                
                 # Update branch - use provided branch, default branch, or 'HQ001'
-                if branch_id:
-                    user.branch_id = branch_id
-                elif user.default_branch_id:
-                    user.branch_id = user.default_branch_id
-                elif not user.branch_id:
-                    user.branch_id = 'HQ001'  # Default to head office
+                new_branch_id = branch_id or user.default_branch_id or user.branch_id or 'HQ001'
+                if user.branch_id != new_branch_id:
+                    updates['branch_id'] = new_branch_id
+                
+                # Only write here when the row actually changed
+                if updates:
+                    db.session.execute(update(User).where(User.id == user.id).values(**updates))
+                    db.session.commit()
                 
-                # Update last login
-                user.last_login = datetime.utcnow()
-                db.session.commit()
+                # Update last login in the background
+                _write_behind_executor.submit(record_last_login, user.id, datetime.utcnow())
                 
                 login_user(user)
+                _missing_user_cache.pop(str(user.id))
                 
                 # Check if password change is required
                 if user.must_change_password:
@@ -133,12 +237,46 @@ def login():
             flash('Invalid username or password.', 'error')
     
     # Get available branches for login form
-    try:
-        branches = db.session.execute(db.text("SELECT branch_code as id, branch_name as name FROM branches WHERE active = TRUE ORDER BY branch_name")).fetchall()
-    except Exception as e:
-        logging.warning(f"Branches query failed, using default: {e}")
-        branches = [{'id': '01', 'name': 'Main Branch'}]
-    return render_template('login.html', branches=branches)
+    return render_template('login.html', branches=active_branches())
+
+def active_branches():
+    """Active branches for the login form, cached until branches change"""
+    branches = _branches_cache.get('active')
+    if branches is None:
+        try:
+            branches = db.session.execute(
+                select(Branch.branch_code.label('id'), Branch.branch_name.label('name'))
+                .where(Branch.active.is_(True))
+                .order_by(Branch.branch_name)
+            ).all()
+        except Exception as e:
+            # Not cached, so the real list is back as soon as the database recovers
+            db.session.rollback()
+            logging.warning(f"Branches query failed, using default: {e}")
+            return [{'id': '01', 'name': 'Main Branch'}]
+        _branches_cache.set('active', branches)
+    return branches
+
+def record_last_login(user_id, logged_in_at):
+    """Store a user's last login time (runs on the write-behind executor)"""
+    with app.app_context():
+        try:
+            db.session.execute(update(User).where(User.id == user_id).values(last_login=logged_in_at))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Error recording last login for user {user_id}: {str(e)}")
+
+def _dummy_password_hash():
+    """Hash checked for unknown usernames, made once with the configured method"""
+    global _DUMMY_PASSWORD_HASH
+    if _DUMMY_PASSWORD_HASH is None:
+        _DUMMY_PASSWORD_HASH = generate_password_hash('dummy-password', method=app.config['PASSWORD_HASH_METHOD'])
+    return _DUMMY_PASSWORD_HASH
+
+def invalidate_branches_cache():
+    """Drop the cached login branch list after branches are added or changed"""
+    _branches_cache.clear()
 
 @app.route('/logout')
 @login_required
@@ -152,7 +290,13 @@ def logout():
 def dashboard():
     try:
         # Get dashboard statistics for available modules only
-        serial_transfer_count = SerialNumberTransfer.query.filter_by(user_id=current_user.id).count()
+        serial_transfer_count = _transfer_count_cache.get(current_user.id)
+        if serial_transfer_count is None:
+            serial_transfer_count = db.session.execute(
+                select(func.count()).select_from(SerialNumberTransfer)
+                .where(SerialNumberTransfer.user_id == current_user.id)
+            ).scalar()
+            _transfer_count_cache.set(current_user.id, serial_transfer_count)
         
         stats = {
             'serial_transfer_count': serial_transfer_count
@@ -161,8 +305,16 @@ def dashboard():
         # Get recent activity - live data from database
         recent_activities = []
         
-        # Get recent serial transfers
-        recent_serial_transfers = SerialNumberTransfer.query.filter_by(user_id=current_user.id).order_by(SerialNumberTransfer.created_at.desc()).limit(10).all()
+        # Get recent serial transfers (only the columns shown on the dashboard),
+        # already newest first and limited to 10 by the query
+        recent_serial_transfers = db.session.execute(
+            select(
+                SerialNumberTransfer.transfer_number,
+                SerialNumberTransfer.created_at,
+                SerialNumberTransfer.status
+            ).where(SerialNumberTransfer.user_id == current_user.id)
+            .order_by(SerialNumberTransfer.created_at.desc()).limit(10)
+        ).all()
         for transfer in recent_serial_transfers:
             recent_activities.append({
                 'type': 'Serial Transfer',
@@ -171,10 +323,6 @@ def dashboard():
                 'status': transfer.status
             })
         
-        # Sort recent activities by date
-        recent_activities.sort(key=lambda x: x['created_at'], reverse=True)
-        recent_activities = recent_activities[:10]  # Limit to 10 most recent
-        
         return render_template('dashboard.html', 
                              stats=stats, 
                              recent_activities=recent_activities)
@@ -196,12 +344,26 @@ def inventory_transfer_serial():
         return redirect(url_for('dashboard'))
     
     try:
-        # Get all serial transfers for current user
-        serial_transfers = SerialNumberTransfer.query.filter_by(user_id=current_user.id)\
-            .order_by(SerialNumberTransfer.created_at.desc()).all()
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('per_page', 25, type=int)
+        
+        # Ensure per_page is within allowed range
+        if per_page not in [10, 25, 50, 100]:
+            per_page = 25
+        
+        # Get one page of serial transfers for current user
+        # The listing shows header columns only; raiseload flags any lazy load added to the template
+        transfers_pagination = SerialNumberTransfer.query.options(
+            defer(SerialNumberTransfer.notes), defer(SerialNumberTransfer.qc_notes),
+            raiseload('*')
+        ).filter_by(user_id=current_user.id)\
+            .order_by(SerialNumberTransfer.created_at.desc())\
+            .paginate(page=page, per_page=per_page, error_out=False)
         
         return render_template('serial_transfer_index.html', 
-                             serial_transfers=serial_transfers)
+                             serial_transfers=transfers_pagination.items,
+                             pagination=transfers_pagination,
+                             per_page=per_page)
     except Exception as e:
         logging.error(f"Error in inventory_transfer_serial: {e}")
         flash('Database error occurred', 'error')
@@ -220,21 +382,19 @@ def user_management():
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 10, type=int)
         
-        query = User.query
-        
-        if search_term:
-            query = query.filter(
-                or_(
-                    User.username.contains(search_term),
-                    User.first_name.contains(search_term),
-                    User.last_name.contains(search_term),
-                    User.email.contains(search_term),
-                    User.role.contains(search_term)
-                )
-            )
-        
-        users_pagination = query.order_by(User.created_at.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
+        # The table shows user columns only; raiseload flags any lazy load added to the template
+        query = User.query.options(raiseload('*'))
+        
+        if search_term and app.config.get('USER_TRGM_SEARCH'):
+            # Substring match served by the pg_trgm index
+            query = query.filter(_USER_SUBSTRING_FILTER).params(user_search=f'%{_escape_like(search_term)}%')
+        elif search_term:
+            # Prefix match so the username/email indexes can be used
+            query = query.filter(_USER_PREFIX_FILTER).params(user_search=f'{_escape_like(search_term)}%')
+        
+        # The page never shows a total, so skip the COUNT(*) over the filtered users
+        users_pagination = query.order_by(User.created_at.desc(), User.id.desc()).paginate(
+            page=page, per_page=per_page, error_out=False, count=False
         )
         
         users = users_pagination.items
@@ -253,6 +413,18 @@ def user_management():
                          search_term=search_term,
                          per_page=per_page)
 
+def _escape_like(term):
+    """Escape LIKE wildcards in a search term (escape character '/')"""
+    return term.replace('/', '//').replace('%', '/%').replace('_', '/_')
+
+# User search filters, built once; the term is bound per request so the
+# compiled SQL is reused from the engine's statement cache
+_USER_PREFIX_FILTER = or_(*(
+    field.like(bindparam('user_search'), escape='/')
+    for field in (User.username, User.first_name, User.last_name, User.email, User.role)
+))
+_USER_SUBSTRING_FILTER = literal_column(USER_SEARCH_EXPR).ilike(bindparam('user_search'), escape='/')
+
 @app.route('/create_user', methods=['POST'])
 @login_required
 def create_user():
@@ -273,20 +445,11 @@ def create_user():
             flash('All required fields must be filled.', 'error')
             return redirect(url_for('user_management'))
         
-        # Check for existing user
-        existing_user = User.query.filter(
-            or_(User.username == username, User.email == email)
-        ).first()
-        
-        if existing_user:
-            flash('Username or email already exists.', 'error')
-            return redirect(url_for('user_management'))
-        
-        # Create new user
+        # Create new user (the unique username/email constraints reject duplicates)
         new_user = User()
         new_user.username = username
         new_user.email = email
-        new_user.password_hash = generate_password_hash(password) if password else generate_password_hash('defaultpass')
+        new_user.password_hash = generate_password_hash(password or 'defaultpass', method=app.config['PASSWORD_HASH_METHOD'])
         new_user.first_name = first_name
         new_user.last_name = last_name
         new_user.role = role
@@ -298,6 +461,10 @@ def create_user():
         
         flash(f'User {username} created successfully.', 'success')
         
+    except IntegrityError:
+        # Unique constraint on username/email
+        db.session.rollback()
+        flash('Username or email already exists.', 'error')
     except Exception as e:
         db.session.rollback()
         logging.error(f"Error creating user: {e}")
@@ -320,7 +487,7 @@ def change_password():
         elif not new_password or len(new_password) < 6:
             flash('Password must be at least 6 characters long.', 'error')
         else:
-            current_user.password_hash = generate_password_hash(new_password)
+            current_user.password_hash = generate_password_hash(new_password, method=app.config['PASSWORD_HASH_METHOD'])
             current_user.must_change_password = False
             db.session.commit()
             
@@ -340,11 +507,18 @@ def qc_dashboard():
     
     try:
         # Get all submitted serial transfers waiting for QC
-        submitted_transfers = SerialNumberTransfer.query.filter_by(status='submitted')\
+        # (the template shows the creator and counts items/serials per transfer)
+        submitted_transfers = SerialNumberTransfer.query.options(
+            defer(SerialNumberTransfer.notes), defer(SerialNumberTransfer.qc_notes),
+            joinedload(SerialNumberTransfer.user),
+            selectinload(SerialNumberTransfer.items).selectinload(SerialNumberTransferItem.serial_numbers)
+        ).filter_by(status='submitted')\
             .order_by(SerialNumberTransfer.created_at.desc()).all()
         
-        # Get recently approved/rejected transfers for review
-        recent_qc_transfers = SerialNumberTransfer.query.filter(
+        # Get recently approved/rejected transfers for review (qc_notes is shown there)
+        recent_qc_transfers = SerialNumberTransfer.query.options(
+            defer(SerialNumberTransfer.notes), lazyload(SerialNumberTransfer.items)
+        ).filter(
             SerialNumberTransfer.status.in_(['qc_approved', 'posted', 'rejected'])
         ).filter_by(qc_approver_id=current_user.id)\
          .order_by(SerialNumberTransfer.qc_approved_at.desc()).limit(10).all()
@@ -365,7 +539,9 @@ def qc_approve_serial_transfer(transfer_id):
         return jsonify({'success': False, 'error': 'QC permissions required'}), 403
     
     try:
-        transfer = SerialNumberTransfer.query.get_or_404(transfer_id)
+        transfer = db.session.get(SerialNumberTransfer, transfer_id, options=[lazyload(SerialNumberTransfer.items)])
+        if not transfer:
+            return jsonify({'success': False, 'error': 'Transfer not found'}), 404
         
         if transfer.status != 'submitted':
             return jsonify({'success': False, 'error': 'Only submitted transfers can be approved'}), 400
@@ -373,50 +549,180 @@ def qc_approve_serial_transfer(transfer_id):
         # Get QC notes
         qc_notes = request.json.get('qc_notes', '') if request.is_json else request.form.get('qc_notes', '')
         
-        # Update transfer status
-        old_status = transfer.status
-        transfer.status = 'qc_approved'
-        transfer.qc_approver_id = current_user.id
-        transfer.qc_approved_at = datetime.utcnow()
-        transfer.qc_notes = qc_notes
-        
-        # Mark all items as approved
-        for item in transfer.items:
-            item.qc_status = 'approved'
-        
-        # Post to SAP B1 as Stock Transfer
-        sap = SAPIntegration()
-        logging.info(f"🚀 Posting Serial Transfer {transfer_id} to SAP B1...")
-        
-        # Create SAP stock transfer document
-        sap_result = sap.create_serial_number_stock_transfer(transfer)
-        
-        if not sap_result.get('success'):
-            # Rollback approval if SAP posting fails
+        # Update transfer status only if it is still submitted, so two concurrent
+        # approvals cannot both queue a SAP B1 posting
+        claimed = db.session.execute(
+            update(SerialNumberTransfer)
+            .where(SerialNumberTransfer.id == transfer_id,
+                   SerialNumberTransfer.status == 'submitted')
+            .values(status='qc_approved',
+                    qc_approver_id=current_user.id,
+                    qc_approved_at=datetime.utcnow(),
+                    qc_notes=qc_notes,
+                    sap_post_error=None,
+                    sap_post_started_at=None)
+        ).rowcount
+        if not claimed:
             db.session.rollback()
-            sap_error = sap_result.get('error', 'Unknown SAP error')
-            logging.error(f"❌ SAP B1 posting failed: {sap_error}")
-            return jsonify({'success': False, 'error': f'SAP B1 posting failed: {sap_error}'}), 500
+            return jsonify({'success': False, 'error': 'Only submitted transfers can be approved'}), 400
         
-        # SAP posting succeeded - update with document number
-        transfer.sap_document_number = sap_result.get('document_number')
-        transfer.status = 'posted'
-        logging.info(f"✅ Successfully posted to SAP B1: {transfer.sap_document_number}")
+        # Mark all items as approved in a single UPDATE
+        db.session.execute(
+            update(SerialNumberTransferItem)
+            .where(SerialNumberTransferItem.serial_transfer_id == transfer_id)
+            .values(qc_status='approved')
+        )
         
         db.session.commit()
         
-        logging.info(f"✅ Serial Transfer {transfer_id} QC approved and posted to SAP B1")
+        # Post to SAP B1 in the background so the request returns immediately
+        _sap_executor.submit(post_transfer_to_sap, transfer_id)
+        
+        logging.info(f"✅ Serial Transfer {transfer_id} QC approved, SAP B1 posting queued")
         return jsonify({
             'success': True,
-            'message': f'Transfer QC approved and posted to SAP B1 as {transfer.sap_document_number}',
-            'sap_document_number': transfer.sap_document_number
-        })
+            'accepted': True,
+            'message': 'Transfer QC approved, posting to SAP B1 in progress',
+            'transfer_id': transfer_id,
+            'status': 'qc_approved'
+        }), 202
         
     except Exception as e:
         db.session.rollback()
         logging.error(f"Error approving serial transfer: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def post_transfer_to_sap(transfer_id):
+    """Post a QC approved serial transfer to SAP B1 (runs on the background executor)"""
+    with app.app_context():
+        document_number = None
+        try:
+            # Claim the posting so another worker (or a startup re-queue) cannot post it too
+            claimed = db.session.execute(
+                update(SerialNumberTransfer)
+                .where(SerialNumberTransfer.id == transfer_id,
+                       SerialNumberTransfer.status == 'qc_approved',
+                       SerialNumberTransfer.sap_document_number.is_(None),
+                       or_(SerialNumberTransfer.sap_post_started_at.is_(None),
+                           SerialNumberTransfer.sap_post_started_at < datetime.utcnow() - SAP_POST_STALE_AFTER))
+                .values(sap_post_started_at=datetime.utcnow())
+            ).rowcount
+            db.session.commit()
+            if not claimed:
+                return
+            
+            transfer = db.session.get(SerialNumberTransfer, transfer_id)
+            
+            # Post to SAP B1 as Stock Transfer
+            sap = get_sap()
+            logging.info(f"🚀 Posting Serial Transfer {transfer_id} to SAP B1...")
+            
+            # Create SAP stock transfer document
+            sap_result = sap.create_serial_number_stock_transfer(transfer)
+            
+            if not sap_result.get('success'):
+                sap_error = sap_result.get('error', 'Unknown SAP error')
+                logging.error(f"❌ SAP B1 posting failed: {sap_error}")
+                revert_sap_posting(transfer_id, f'SAP B1 posting failed: {sap_error}')
+                return
+            
+            # SAP posting succeeded - update with document number
+            document_number = sap_result.get('document_number')
+            mark_sap_posted(transfer_id, document_number)
+            
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Error posting serial transfer {transfer_id} to SAP B1: {str(e)}")
+            if document_number is None:
+                revert_sap_posting(transfer_id, str(e))
+                return
+            # The document exists in SAP B1 now; try once more to record it so it is not posted again
+            try:
+                mark_sap_posted(transfer_id, document_number)
+            except Exception:
+                db.session.rollback()
+                logging.error(f"❌ Serial Transfer {transfer_id} posted to SAP B1 as {document_number} "
+                              f"but saving the document number failed; reconcile manually")
+
+def mark_sap_posted(transfer_id, document_number):
+    """Record the SAP B1 document number, moving the transfer to posted only if it is still qc_approved"""
+    updated = db.session.execute(
+        update(SerialNumberTransfer)
+        .where(SerialNumberTransfer.id == transfer_id,
+               SerialNumberTransfer.status == 'qc_approved')
+        .values(status='posted', sap_document_number=document_number, sap_post_error=None)
+    ).rowcount
+    db.session.commit()
+    if updated:
+        logging.info(f"✅ Serial Transfer {transfer_id} posted to SAP B1 as {document_number}")
+    else:
+        logging.error(f"❌ Serial Transfer {transfer_id} posted to SAP B1 as {document_number} "
+                      f"but is no longer QC approved; reconcile manually")
+
+def revert_sap_posting(transfer_id, error):
+    """Return a transfer whose SAP B1 posting failed to QC (submitted), keeping the error"""
+    try:
+        db.session.execute(
+            update(SerialNumberTransfer)
+            .where(SerialNumberTransfer.id == transfer_id,
+                   SerialNumberTransfer.status == 'qc_approved')
+            .values(status='submitted',
+                    qc_approver_id=None,
+                    qc_approved_at=None,
+                    sap_post_started_at=None,
+                    sap_post_error=error)
+        )
+        db.session.execute(
+            update(SerialNumberTransferItem)
+            .where(SerialNumberTransferItem.serial_transfer_id == transfer_id)
+            .values(qc_status='pending')
+        )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error reverting serial transfer {transfer_id} after SAP B1 failure: {str(e)}")
+
+def requeue_sap_postings():
+    """Queue approved transfers whose SAP B1 posting was lost (e.g. the worker restarted)"""
+    with app.app_context():
+        try:
+            transfer_ids = db.session.execute(
+                select(SerialNumberTransfer.id)
+                .where(SerialNumberTransfer.status == 'qc_approved',
+                       SerialNumberTransfer.sap_document_number.is_(None),
+                       or_(SerialNumberTransfer.sap_post_started_at.is_(None),
+                           SerialNumberTransfer.sap_post_started_at < datetime.utcnow() - SAP_POST_STALE_AFTER))
+            ).scalars().all()
+        except Exception as e:
+            logging.warning(f"⚠️ Could not check for pending SAP B1 postings: {e}")
+            return
+        for transfer_id in transfer_ids:
+            _sap_executor.submit(post_transfer_to_sap, transfer_id)
+        if transfer_ids:
+            logging.info(f"🔁 Re-queued {len(transfer_ids)} pending SAP B1 postings")
+
+@app.route('/api/serial-transfer/<int:transfer_id>/status', methods=['GET'])
+@app.route('/api/serial-transfer/<int:transfer_id>/sap-status', methods=['GET'])
+@login_required
+def serial_transfer_status(transfer_id):
+    """Poll the status of a serial transfer, e.g. while its SAP B1 posting runs"""
+    transfer = db.session.get(SerialNumberTransfer, transfer_id, options=[lazyload(SerialNumberTransfer.items)])
+    if not transfer:
+        return jsonify({'success': False, 'error': 'Transfer not found'}), 404
+    
+    # Same access as the transfer detail view: the owner, or QC reviewers
+    if (transfer.user_id != current_user.id and current_user.role not in ['admin', 'manager', 'qc']
+            and not current_user.has_permission('qc_dashboard')):
+        return jsonify({'success': False, 'error': 'Access denied'}), 403
+    
+    return jsonify({
+        'success': True,
+        'transfer_id': transfer.id,
+        'status': transfer.status,
+        'sap_document_number': transfer.sap_document_number,
+        'error': transfer.sap_post_error if transfer.status != 'posted' else None
+    })
+
 @app.route('/api/serial-transfer/<int:transfer_id>/qc-reject', methods=['POST'])
 @login_required
 def qc_reject_serial_transfer(transfer_id):
@@ -425,10 +731,9 @@ def qc_reject_serial_transfer(transfer_id):
         return jsonify({'success': False, 'error': 'QC permissions required'}), 403
     
     try:
-        transfer = SerialNumberTransfer.query.get_or_404(transfer_id)
-        
-        if transfer.status != 'submitted':
-            return jsonify({'success': False, 'error': 'Only submitted transfers can be rejected'}), 400
+        transfer = db.session.get(SerialNumberTransfer, transfer_id, options=[lazyload(SerialNumberTransfer.items)])
+        if not transfer:
+            return jsonify({'success': False, 'error': 'Transfer not found'}), 404
         
         # Get QC notes (required for rejection)
         qc_notes = request.json.get('qc_notes', '') if request.is_json else request.form.get('qc_notes', '')
@@ -436,15 +741,27 @@ def qc_reject_serial_transfer(transfer_id):
         if not qc_notes.strip():
             return jsonify({'success': False, 'error': 'QC notes are required for rejection'}), 400
         
-        # Update transfer status
-        transfer.status = 'rejected'
-        transfer.qc_approver_id = current_user.id
-        transfer.qc_approved_at = datetime.utcnow()
-        transfer.qc_notes = qc_notes
+        # Update transfer status only if it is still submitted, so a transfer that was
+        # approved meanwhile (and queued for SAP B1 posting) cannot be rejected
+        claimed = db.session.execute(
+            update(SerialNumberTransfer)
+            .where(SerialNumberTransfer.id == transfer_id,
+                   SerialNumberTransfer.status == 'submitted')
+            .values(status='rejected',
+                    qc_approver_id=current_user.id,
+                    qc_approved_at=datetime.utcnow(),
+                    qc_notes=qc_notes)
+        ).rowcount
+        if not claimed:
+            db.session.rollback()
+            return jsonify({'success': False, 'error': 'Only submitted transfers can be rejected'}), 409
         
-        # Mark all items as rejected
-        for item in transfer.items:
-            item.qc_status = 'rejected'
+        # Mark all items as rejected in a single UPDATE
+        db.session.execute(
+            update(SerialNumberTransferItem)
+            .where(SerialNumberTransferItem.serial_transfer_id == transfer_id)
+            .values(qc_status='rejected')
+        )
         
         db.session.commit()
         
@@ -481,7 +798,9 @@ def create_serial_transfer():
             return jsonify({'success': False, 'error': 'From and To warehouses must be different'}), 400
         
         # Check if transfer number already exists
-        existing_transfer = SerialNumberTransfer.query.filter_by(transfer_number=transfer_number).first()
+        existing_transfer = db.session.query(SerialNumberTransfer.id).filter_by(
+            transfer_number=transfer_number
+        ).limit(1).scalar()
         if existing_transfer:
             # Auto-generate a new unique number
             from datetime import datetime
@@ -501,6 +820,7 @@ def create_serial_transfer():
         
         db.session.add(transfer)
         db.session.commit()
+        _transfer_count_cache.pop(current_user.id)
         
         logging.info(f"✅ Serial Transfer {transfer_number} created by {current_user.username}")
         return jsonify({
@@ -510,6 +830,10 @@ def create_serial_transfer():
             'transfer_number': transfer_number
         })
         
+    except IntegrityError:
+        # Unique constraint on transfer_number caught a concurrent duplicate
+        db.session.rollback()
+        return jsonify({'success': False, 'error': f'Transfer number {transfer_number} already exists'}), 409
     except Exception as e:
         db.session.rollback()
         logging.error(f"Error creating serial transfer: {e}")
@@ -520,7 +844,12 @@ def create_serial_transfer():
 def delete_serial_transfer(transfer_id):
     """Delete serial transfer (only draft transfers)"""
     try:
-        transfer = SerialNumberTransfer.query.get_or_404(transfer_id)
+        # Load items and their serials up front for the cascade delete
+        transfer = db.session.get(SerialNumberTransfer, transfer_id, options=[
+            selectinload(SerialNumberTransfer.items).selectinload(SerialNumberTransferItem.serial_numbers)
+        ])
+        if not transfer:
+            return jsonify({'success': False, 'error': 'Transfer not found'}), 404
         
         # Check permissions
         if transfer.user_id != current_user.id and current_user.role not in ['admin', 'manager']:
@@ -532,6 +861,7 @@ def delete_serial_transfer(transfer_id):
         # Delete the transfer (cascade will handle items and serials)
         db.session.delete(transfer)
         db.session.commit()
+        _transfer_count_cache.pop(transfer.user_id)
         
         logging.info(f"🗑️ Serial Transfer {transfer.transfer_number} deleted by {current_user.username}")
         return jsonify({
@@ -2,15 +2,32 @@ import requests
 import json
 import logging
 import os
+import threading
+import time
 from datetime import datetime
 import urllib.parse
 import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from ttl_cache import SingleFlight, TTLCache
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 
 class SAPIntegration:
 
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def instance(cls):
+        """Shared instance so requests reuse one pooled, logged-in SAP B1 session"""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
     def __init__(self):
         # Use environment variables directly to avoid circular import
         self.base_url = os.environ.get('SAP_B1_SERVER', '')
@@ -18,17 +35,32 @@ class SAPIntegration:
         self.password = os.environ.get('SAP_B1_PASSWORD', '')
         self.company_db = os.environ.get('SAP_B1_COMPANY_DB', '')
         self.session_id = None
+        self.session_expires_at = None
+        self._login_lock = threading.Lock()
+        # After a failed login, skip new attempts until then instead of queueing on the lock
+        self._login_retry_at = 0
+        self.login_backoff = int(os.environ.get('SAP_LOGIN_BACKOFF', 30))
         self.session = requests.Session()
         self.session.verify = False  # For development, in production use proper SSL
+        # Pooled keep-alive connections; retry connection failures and idempotent requests
+        adapter = HTTPAdapter(pool_connections=10,
+                              pool_maxsize=20,
+                              max_retries=Retry(total=2, backoff_factor=0.1))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # No connect retries on Login: a down server should fail once, not three times
+        if self.base_url:
+            self.session.mount(f"{self.base_url}/b1s/v1/Login", HTTPAdapter(max_retries=0))
+        self.session.hooks['response'].append(self._relogin_on_401)
         self.is_offline = False
 
         # Cache for frequently accessed data
         self._warehouse_cache = {}
         self._bin_cache = {}
-        self._bin_location_cache = {}  # Cache for BinLocations API
+        self._bin_location_cache = TTLCache(maxsize=1024, ttl=600)  # Cache for BinLocations API
         self._branch_cache = {}
         self._item_cache = {}
-        self._batch_cache = {}
+        self._batch_cache = TTLCache(maxsize=1024, ttl=120)
 
     def login(self):
         """Login to SAP B1 Service Layer"""
@@ -48,27 +80,64 @@ class SAPIntegration:
         try:
             response = self.session.post(login_url,
                                          json=login_data,
-                                         timeout=30)
+                                         timeout=(10, 30))
             if response.status_code == 200:
-                self.session_id = response.json().get('SessionId')
+                login_result = response.json()
+                self.session_id = login_result.get('SessionId')
+                # SessionTimeout is in minutes; renew a minute early
+                timeout_minutes = login_result.get('SessionTimeout') or 30
+                self.session_expires_at = time.monotonic() + max(timeout_minutes - 1, 1) * 60
+                self._login_retry_at = 0
                 logging.info("Successfully logged in to SAP B1")
                 return True
             else:
                 logging.warning(
                     f"SAP B1 login failed: {response.text}. Running in offline mode."
                 )
+                self._login_retry_at = time.monotonic() + self.login_backoff
                 return False
         except Exception as e:
             logging.warning(
                 f"SAP B1 login error: {str(e)}. Running in offline mode.")
             self.is_offline = True
+            self._login_retry_at = time.monotonic() + self.login_backoff
             return False
 
+    def _session_valid(self):
+        return bool(self.session_id) and (
+            self.session_expires_at is None or time.monotonic() < self.session_expires_at)
+
     def ensure_logged_in(self):
-        """Ensure we have a valid session"""
-        if not self.session_id:
+        """Ensure we have a valid session, logging in again once it has expired"""
+        if self._session_valid():
+            return True
+        if time.monotonic() < self._login_retry_at:
+            return False  # a login just failed; don't hit SAP again yet
+        with self._login_lock:
+            if self._session_valid():
+                return True
+            if time.monotonic() < self._login_retry_at:
+                return False
             return self.login()
-        return True
+
+    def _relogin_on_401(self, response, *args, **kwargs):
+        """Session hook: on 401 (e.g. Service Layer restarted) log in again and retry once"""
+        request = response.request
+        if (response.status_code != 401 or request.url.endswith('/Login')
+                or getattr(request, 'sap_relogin_retry', False)):
+            return response
+        # Drop the session only if no other request has renewed it already
+        if self.session_id and f'B1SESSION={self.session_id}' in request.headers.get('Cookie', ''):
+            self.session_id = None
+            self.session_expires_at = None
+        if not self.ensure_logged_in():
+            return response
+        retry = request.copy()
+        retry.sap_relogin_retry = True
+        retry.headers.pop('Cookie', None)
+        retry.prepare_cookies(self.session.cookies)
+        logging.info("SAP B1 session was rejected, retrying with a new session")
+        return self.session.send(retry, **kwargs)
 
     def get_inventory_transfer_request(self, doc_num):
         """Get specific inventory transfer request from SAP B1"""
@@ -715,10 +784,8 @@ class SAPIntegration:
     def get_batch_number_details(self, item_code):
         """Get batch number details for a specific item using SAP B1 API - exact endpoint from user"""
         try:
-            if not self.session_id:
-                login_result = self.login()
-                if not login_result:
-                    return {'success': False, 'error': 'SAP B1 login failed'}
+            if not self.ensure_logged_in():
+                return {'success': False, 'error': 'SAP B1 login failed'}
             
             # Use the exact API endpoint you provided
             url = f"{self.base_url}/BatchNumberDetails"
@@ -754,8 +821,9 @@ class SAPIntegration:
     def get_batch_numbers(self, item_code):
         """Get batch numbers for specific item from SAP B1 BatchNumberDetails"""
         # Check cache first
-        if item_code in self._batch_cache:
-            return self._batch_cache[item_code]
+        batches = self._batch_cache.get(item_code)
+        if batches is not None:
+            return batches
 
         if not self.ensure_logged_in():
             logging.warning(
@@ -777,7 +845,6 @@ class SAPIntegration:
                 "ManufacturingDate": None,
                 "AdmissionDate": "2025-01-01T00:00:00Z"
             }]
-            self._batch_cache[item_code] = mock_batches
             return mock_batches
 
         try:
@@ -793,7 +860,7 @@ class SAPIntegration:
                 )
 
                 # Cache the results
-                self._batch_cache[item_code] = batches
+                self._batch_cache.set(item_code, batches)
                 return batches
             else:
                 logging.warning(
@@ -901,8 +968,9 @@ class SAPIntegration:
         """Get warehouse and bin code from BinLocations API by AbsEntry"""
         try:
             # Check cache first
-            if bin_abs_entry in self._bin_location_cache:
-                return self._bin_location_cache[bin_abs_entry]
+            cached = self._bin_location_cache.get(bin_abs_entry)
+            if cached is not None:
+                return cached
             
             if not self.ensure_logged_in():
                 logging.warning("⚠️ SAP B1 not available, returning mock bin location")
@@ -911,7 +979,6 @@ class SAPIntegration:
                     'BinCode': f'7000-FG-BIN-{bin_abs_entry}',
                     'AbsEntry': bin_abs_entry
                 }
-                self._bin_location_cache[bin_abs_entry] = mock_data
                 return mock_data
             
             # Use the exact API URL format from user's request
@@ -932,7 +999,7 @@ class SAPIntegration:
                     }
                     
                     # Cache the result
-                    self._bin_location_cache[bin_abs_entry] = result
+                    self._bin_location_cache.set(bin_abs_entry, result)
                     logging.info(f"✅ Found bin location: {result['Warehouse']} - {result['BinCode']}")
                     return result
                 else:
@@ -1157,6 +1224,41 @@ class SAPIntegration:
                 f"Error getting item details for {item_code}: {str(e)}")
             return None
 
+    def get_items_details(self, item_codes):
+        """Get ItemName/SalesUnit for several items from SAP B1, keyed by item code"""
+        if not self.ensure_logged_in():
+            return {}
+
+        items = {}
+        codes = list(dict.fromkeys(item_codes))
+        # Keep the $filter short enough for the Service Layer URL limit
+        for start in range(0, len(codes), 50):
+            chunk = codes[start:start + 50]
+            filter_clause = " or ".join(
+                "ItemCode eq '{}'".format(code.replace("'", "''"))
+                for code in chunk)
+            params = {
+                '$select': 'ItemCode,ItemName,SalesUnit',
+                '$filter': filter_clause
+            }
+            try:
+                url = f"{self.base_url}/b1s/v1/Items"
+                response = self.session.get(url,
+                                            params=params,
+                                            headers={'Prefer': f'odata.maxpagesize={len(chunk)}'},
+                                            timeout=10)
+                if response.status_code == 200:
+                    for item_data in response.json().get('value', []):
+                        items[item_data.get('ItemCode')] = item_data
+                else:
+                    logging.error(
+                        f"Failed to get item details for {len(chunk)} items: {response.text}"
+                    )
+            except Exception as e:
+                logging.error(f"Error getting item details in batch: {str(e)}")
+
+        return items
+
     def create_inventory_counting(self, count_document):
         """Create Inventory Counting Document in SAP B1"""
         if not self.ensure_logged_in():
@@ -1472,7 +1574,6 @@ class SAPIntegration:
         """Sync SAP B1 pick list line items and bin allocations to local database"""
         from app import db
         from models import PickListLine, PickListBinAllocation
-        import json
         
         try:
             # Clear existing lines and bin allocations - Fix for SQLAlchemy join delete issue
@@ -1681,6 +1782,10 @@ class SAPIntegration:
                     }
 
                 db.session.commit()
+
+                # Branches changed, refresh the login form list
+                from routes import invalidate_branches_cache
+                invalidate_branches_cache()
                 logging.info(
                     f"Synced {len(warehouses)} warehouses from SAP B1")
                 return True
@@ -2380,7 +2485,6 @@ class SAPIntegration:
         url = f"{self.base_url}/b1s/v1/PurchaseDeliveryNotes"
 
         # Log the payload for debugging - Enhanced JSON logging
-        import json
         logging.info("=" * 80)
         logging.info("PURCHASE DELIVERY NOTE - JSON PAYLOAD")
         logging.info("=" * 80)
@@ -2858,12 +2962,12 @@ class SAPIntegration:
             logging.info("=" * 80)
             logging.info("SERIAL NUMBER STOCK TRANSFER - JSON PAYLOAD")
             logging.info("=" * 80)
-            import json
             logging.info(json.dumps(transfer_data, indent=2, default=str))
             logging.info("=" * 80)
             print(f"transfer_item (repr) --> {repr(transfer_data)}")
-            # Submit to SAP B1
-            response = self.session.post(url, json=transfer_data)
+            # Submit to SAP B1; the read timeout (plus one re-login retry) stays well inside
+            # the 10 minute window after which routes.py treats a posting claim as abandoned
+            response = self.session.post(url, json=transfer_data, timeout=(10, 120))
             
             if response.status_code == 201:
                 result = response.json()
@@ -2913,10 +3017,52 @@ class SAPIntegration:
                 logout_url = f"{self.base_url}/b1s/v1/Logout"
                 self.session.post(logout_url)
                 self.session_id = None
+                self.session_expires_at = None
                 logging.info("Logged out from SAP B1")
             except Exception as e:
                 logging.error(f"Error logging out from SAP B1: {str(e)}")
 
 
-# Create global SAP integration instance for backward compatibility
-sap_b1 = SAPIntegration()
+def get_sap():
+    """Shared, logged-in-on-demand SAP B1 client for request handlers"""
+    return SAPIntegration.instance()
+
+
+# Global SAP integration instance for backward compatibility (the shared instance)
+sap_b1 = get_sap()
+
+
+# Warehouse list for the dropdown APIs, keyed by SAP server URL
+_warehouse_list_cache = TTLCache(maxsize=8, ttl=int(os.environ.get('SAP_WAREHOUSE_CACHE_TTL', 300)))
+_warehouse_list_lookups = SingleFlight()  # one SAP call per cache miss
+
+def fetch_warehouses():
+    """Warehouse list from SAP B1, cached in process; None when SAP is unavailable"""
+    sap = get_sap()
+    
+    # Serve from cache when the SAP list was fetched recently
+    warehouses = _warehouse_list_cache.get(sap.base_url)
+    if warehouses is not None:
+        return warehouses
+    
+    # Try to get warehouses from SAP B1, once for all concurrent requests
+    with _warehouse_list_lookups.lock(('warehouses', sap.base_url)):
+        warehouses = _warehouse_list_cache.get(sap.base_url)
+        if warehouses is not None:
+            return warehouses
+        
+        if sap.ensure_logged_in():
+            try:
+                url = f"{sap.base_url}/b1s/v1/Warehouses"
+                response = sap.session.get(url, timeout=10)
+                
+                if response.status_code == 200:
+                    data = response.json()
+                    warehouses = data.get('value', [])
+                    logging.info(f"Retrieved {len(warehouses)} warehouses from SAP B1")
+                    _warehouse_list_cache.set(sap.base_url, warehouses)
+                    return warehouses
+            except Exception as e:
+                logging.error(f"Error getting warehouses from SAP: {str(e)}")
+    
+    return None
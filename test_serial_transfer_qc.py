@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Serial Transfer QC Test Script
+Checks that a QC reject arriving after an approval cannot undo the approval
+(runs against the configured database; the rows it creates are removed afterwards)
+"""
+
+import sys
+import uuid
+from werkzeug.security import generate_password_hash
+
+import main  # registers the routes
+import routes
+from app import app, db
+from models import User, SerialNumberTransfer, SerialNumberTransferItem
+
+
+class RecordingExecutor:
+    """Stands in for the SAP B1 posting executor; records queued postings instead of posting"""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, *args):
+        self.submitted.append((fn, args))
+
+
+def test_reject_after_approve():
+    """A reject that arrives after an approval gets 409 and leaves the transfer QC approved"""
+    suffix = uuid.uuid4().hex[:8]
+    executor = RecordingExecutor()
+    original_executor = routes._sap_executor
+    routes._sap_executor = executor
+
+    with app.app_context():
+        qc_user = User(username=f'qc_test_{suffix}',
+                       email=f'qc_test_{suffix}@example.com',
+                       password_hash=generate_password_hash('qc-test-pass',
+                                                            method=app.config['PASSWORD_HASH_METHOD']),
+                       role='qc')
+        db.session.add(qc_user)
+        db.session.flush()
+        transfer = SerialNumberTransfer(transfer_number=f'ST-TEST-{suffix}',
+                                        status='submitted',
+                                        user_id=qc_user.id,
+                                        from_warehouse='WH01',
+                                        to_warehouse='WH02')
+        transfer.items.append(SerialNumberTransferItem(item_code='TEST', quantity=1,
+                                                       from_warehouse_code='WH01',
+                                                       to_warehouse_code='WH02'))
+        db.session.add(transfer)
+        db.session.commit()
+        user_id, transfer_id = qc_user.id, transfer.id
+
+    try:
+        client = app.test_client()
+        client.post('/login', data={'username': f'qc_test_{suffix}', 'password': 'qc-test-pass'})
+
+        response = client.post(f'/api/serial-transfer/{transfer_id}/qc-approve', json={'qc_notes': 'ok'})
+        assert response.status_code == 202, response.get_json()
+
+        response = client.post(f'/api/serial-transfer/{transfer_id}/qc-reject', json={'qc_notes': 'too late'})
+        assert response.status_code == 409, response.get_json()
+
+        with app.app_context():
+            transfer = db.session.get(SerialNumberTransfer, transfer_id)
+            assert transfer.status == 'qc_approved'
+            assert transfer.qc_notes == 'ok'
+            assert [item.qc_status for item in transfer.items] == ['approved']
+        assert executor.submitted == [(routes.post_transfer_to_sap, (transfer_id,))]
+        return True
+    finally:
+        routes._sap_executor = original_executor
+        with app.app_context():
+            transfer = db.session.get(SerialNumberTransfer, transfer_id)
+            if transfer:
+                db.session.delete(transfer)
+            db.session.execute(db.delete(User).where(User.id == user_id))
+            db.session.commit()
+
+
+if __name__ == "__main__":
+    print("🚀 Starting Serial Transfer QC Tests")
+    print("=" * 50)
+
+    try:
+        success = test_reject_after_approve()
+    except AssertionError as e:
+        print(f"❌ Reject after approve test failed: {e}")
+        success = False
+
+    if success:
+        print("\n✅ All tests completed successfully!")
+        sys.exit(0)
+    else:
+        print("\n❌ Some tests failed!")
+        sys.exit(1)
@@ -0,0 +1,84 @@
+"""
+In-process TTL cache
+Keeps rarely changing lookups (SAP master data, dropdown lists) in memory between requests
+"""
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe key/value cache whose entries expire after `ttl` seconds.
+
+    Once `maxsize` entries are stored the least recently used entry is evicted.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if missing or expired"""
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Store value for key, evicting the oldest entries beyond maxsize"""
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Remove key from the cache and return its value"""
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+            return default if entry is _MISSING else entry[0]
+
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._data.clear()
+
+
+class SingleFlight:
+    """Per-key locks so only one thread loads a missing cache entry at a time.
+
+    Concurrent callers for the same key wait for the first one and should then
+    re-check the cache before loading themselves.
+    """
+
+    def __init__(self):
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def lock(self, key):
+        """Hold the lock for key; the lock is dropped once no thread uses it"""
+        with self._lock:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]